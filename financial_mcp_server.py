@@ -4,30 +4,137 @@ Financial Analysis MCP Server - Versione Completa
 Server MCP per analisi tecnica, fondamentale e gestione portafogli
 """
 
+import argparse
 import asyncio
-import json
+import math
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Any, Dict, List, Optional, Tuple
+from functools import partial, reduce
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
 
-import yfinance as yf
+# yfinance è importato solo nelle funzioni che scaricano dati: il suo import pesa
+# sull'avvio del server anche quando non arriva nessuna richiesta
 import pandas as pd
 import numpy as np
-import pandas_ta as ta
+import orjson
+from cachetools import TTLCache
 
 from mcp.server import Server
 from mcp.server.stdio import stdio_server
 from mcp.types import Resource, Tool, TextContent
 
+try:
+    from numba import njit
+except ImportError:
+    # Senza numba i kernel degli indicatori girano come Python puro: più lenti, stessi risultati
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda func: func
+
 # ============================================================================
 # CONFIGURAZIONE
 # ============================================================================
 
 CACHE_DURATION = 300
+INFO_CACHE_DURATION = 86400
+CACHE_MAXSIZE = 512
+CACHE_DIR = os.environ.get("FINANCIAL_MCP_CACHE_DIR", ".cache")
 RSI_OVERBOUGHT = 70
 RSI_OVERSOLD = 30
+# Event loop e parser HTTP in C per il trasporto http (uvloop non esiste su Windows)
+UVICORN_OPTIONS = {"loop": "asyncio" if sys.platform == "win32" else "uvloop", "http": "httptools"}
+
+# ============================================================================
+# CACHE
+# ============================================================================
+
+class FileCache:
+    """
+    Cache su disco dei dati storici: un file per giorno, valido per CACHE_DURATION secondi.
+    Il ticker effettivo (eventuale suffisso di borsa) viaggia nei metadati del parquet.
+    """
+
+    # Chiave dei metadati dello schema parquet con il ticker risolto
+    META_TICKER = b"financial_mcp.info_ticker"
+
+    def __init__(self, directory: str = CACHE_DIR):
+        self.directory = Path(directory)
+
+    def _path(self, ticker: str, periodo: str, giorno: str) -> Path:
+        return self.directory / f"{ticker}_{periodo}_{giorno}.parquet"
+
+    def get(self, ticker: str, periodo: str) -> Optional[Tuple[pd.DataFrame, str]]:
+        """Legge (dati, ticker risolto) del giorno, None se assenti, più vecchi di CACHE_DURATION o illeggibili."""
+        path = self._path(ticker, periodo, datetime.now().strftime("%Y%m%d"))
+        try:
+            # Stessa scadenza della cache in memoria: il disco non deve congelare i prezzi fino a mezzanotte
+            if path.stat().st_mtime < time.time() - CACHE_DURATION:
+                return None
+            import pyarrow.parquet as pq
+
+            table = pq.read_table(path)
+            info_ticker = (table.schema.metadata or {}).get(self.META_TICKER, ticker.encode()).decode()
+            return table.to_pandas(), info_ticker
+        except Exception:
+            return None
+
+    def set(self, ticker: str, periodo: str, df: pd.DataFrame, info_ticker: str) -> None:
+        """Salva i dati del giorno con il ticker risolto ed elimina quelli dei giorni precedenti."""
+        if df.empty:
+            return
+        path = self._path(ticker, periodo, datetime.now().strftime("%Y%m%d"))
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            for vecchio in self.directory.glob(self._path(ticker, periodo, "*").name):
+                if vecchio != path:
+                    vecchio.unlink(missing_ok=True)
+            # Scrittura su file temporaneo e os.replace atomico: thread o worker concorrenti
+            # sulla stessa chiave non lasciano mai un parquet troncato al posto di quello finale
+            tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+            try:
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+
+                table = pa.Table.from_pandas(df)
+                metadata = {**(table.schema.metadata or {}), self.META_TICKER: info_ticker.encode()}
+                pq.write_table(table.replace_schema_metadata(metadata), tmp)
+                os.replace(tmp, path)
+            finally:
+                tmp.unlink(missing_ok=True)
+        except Exception:
+            # La cache su disco è un'ottimizzazione: un errore di scrittura non deve bloccare il tool
+            pass
+
+
+class LazyInfo:
+    """Info aziendali scaricate solo alla prima lettura di una chiave."""
+
+    def __init__(self, ticker: str):
+        self.ticker = ticker
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return get_cached_info(self.ticker).get(key, default)
+
+    def __getitem__(self, key: str) -> Any:
+        return get_cached_info(self.ticker)[key]
+
 
 app = Server("financial-analysis-server")
-_data_cache: Dict[str, Dict[str, Any]] = {}
+# Cache LRU con scadenza: la memoria resta limitata anche con molti ticker richiesti.
+# TTLCache non è thread-safe, quindi ogni accesso passa da _cache_lock.
+_data_cache: TTLCache = TTLCache(maxsize=CACHE_MAXSIZE, ttl=CACHE_DURATION)
+_info_cache: TTLCache = TTLCache(maxsize=CACHE_MAXSIZE, ttl=INFO_CACHE_DURATION)
+_cache_lock = threading.Lock()
+_file_cache = FileCache()
+# Pool condiviso per il lavoro bloccante (yfinance, pandas) richiesto dagli handler async:
+# l'event loop resta libero e i download a cache fredda procedono in parallelo
+_EXEC = ThreadPoolExecutor(max_workers=32, thread_name_prefix="fin-io")
 
 
 
@@ -35,34 +142,188 @@ _data_cache: Dict[str, Dict[str, Any]] = {}
 # UTILITY FUNCTIONS
 # ============================================================================
 
-def get_cached_data(ticker: str, periodo: str = "2y") -> Tuple[pd.DataFrame, dict]:
-    """Recupera dati storici con cache."""
+def _cache_lookup(ticker: str, periodo: str) -> Optional[Dict[str, Any]]:
+    """Cerca i dati nella cache in memoria e, in seconda battuta, su disco."""
     cache_key = f"{ticker}_{periodo}"
-    now = datetime.now().timestamp()
+    with _cache_lock:
+        cached = _data_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    letto = _file_cache.get(ticker, periodo)
+    if letto is None:
+        return None
+    df, info_ticker = letto
+    cached = {"df": df, "ticker": info_ticker}
+    with _cache_lock:
+        _data_cache[cache_key] = cached
+    return cached
+
+
+OHLCV_COLUMNS = ["Open", "High", "Low", "Close", "Volume"]
+
+
+def _salva_in_cache(ticker: str, periodo: str, df: pd.DataFrame, info_ticker: str) -> pd.DataFrame:
+    """Salva in cache (memoria e disco) solo le colonne OHLCV usate dai tool."""
+    df = df[[c for c in OHLCV_COLUMNS if c in df.columns]]
+    if isinstance(df.index, pd.DatetimeIndex) and df.index.tz is not None:
+        # Barre giornaliere: conta l'ora locale della borsa. Senza fuso l'indice è identico
+        # sia che arrivi da Ticker.history sia da yf.download(ignore_tz=True)
+        df = df.set_axis(df.index.tz_localize(None))
+    with _cache_lock:
+        _data_cache[f"{ticker}_{periodo}"] = {"df": df, "ticker": info_ticker}
+    _file_cache.set(ticker, periodo, df, info_ticker)
+    return df
 
-    if cache_key in _data_cache:
-        cached = _data_cache[cache_key]
-        if now - cached["timestamp"] < CACHE_DURATION:
-            return cached["df"], cached["info"]
 
-    asset = yf.Ticker(ticker)
-    df = asset.history(period=periodo)
-    info = asset.info
+def get_cached_info(ticker: str) -> dict:
+    """Recupera le info aziendali con cache a lunga scadenza (cambiano di rado)."""
+    with _cache_lock:
+        info = _info_cache.get(ticker)
+    if info is not None:
+        return info
+
+    import yfinance as yf
+
+    info = yf.Ticker(ticker).info
+    with _cache_lock:
+        _info_cache[ticker] = info
+    return info
+
+
+def get_cached_data(ticker: str, periodo: str = "2y") -> Tuple[pd.DataFrame, LazyInfo]:
+    """Recupera dati storici con cache (in memoria e su disco); le info sono caricate solo se lette."""
+    cached = _cache_lookup(ticker, periodo)
+    if cached is not None:
+        return cached["df"], LazyInfo(cached["ticker"])
+
+    import yfinance as yf
+
+    info_ticker = ticker
+    df = yf.Ticker(ticker).history(period=periodo)
 
     if df.empty:
         for suffix in [".MI", ".PA", ".L", ".DE"]:
             try:
                 alt_ticker = f"{ticker}{suffix}"
-                asset = yf.Ticker(alt_ticker)
-                df = asset.history(period=periodo)
+                df = yf.Ticker(alt_ticker).history(period=periodo)
                 if not df.empty:
-                    info = asset.info
+                    info_ticker = alt_ticker
                     break
             except:
                 continue
 
-    _data_cache[cache_key] = {"df": df, "info": info, "timestamp": now}
-    return df, info
+    df = _salva_in_cache(ticker, periodo, df, info_ticker)
+    return df, LazyInfo(info_ticker)
+
+
+async def _run_blocking(func, *args) -> Any:
+    """Esegue una funzione bloccante nel pool condiviso _EXEC."""
+    return await asyncio.get_running_loop().run_in_executor(_EXEC, func, *args)
+
+
+async def _fetch(ticker: str, periodo: str = "2y") -> Tuple[pd.DataFrame, LazyInfo]:
+    """get_cached_data senza bloccare l'event loop."""
+    return await _run_blocking(get_cached_data, ticker, periodo)
+
+
+def _colonne_numpy(df: pd.DataFrame) -> Dict[str, np.ndarray]:
+    """Colonne OHLCV come ndarray float64 contigui, più i giorni di contrattazione in "Giorno"."""
+    colonne = {c: np.ascontiguousarray(df[c].to_numpy(dtype=np.float64)) for c in OHLCV_COLUMNS if c in df.columns}
+    if isinstance(df.index, pd.DatetimeIndex):
+        # Data di calendario locale della borsa (datetime64[D]; _salva_in_cache conserva l'ora
+        # locale): confrontabile tra ticker con fusi orari e unità dell'indice diverse
+        colonne["Giorno"] = df.index.tz_localize(None).normalize().to_numpy(dtype="datetime64[D]")
+    return colonne
+
+
+def get_cached_arrays(ticker: str, periodo: str = "2y") -> Tuple[Dict[str, np.ndarray], LazyInfo]:
+    """Come get_cached_data, ma restituisce le colonne OHLCV come ndarray, estratte una sola volta per voce di cache."""
+    df, info = get_cached_data(ticker, periodo)
+    with _cache_lock:
+        cached = _data_cache.get(f"{ticker}_{periodo}")
+    if cached is None or cached["df"] is not df:
+        return _colonne_numpy(df), info
+
+    colonne = cached.get("colonne")
+    if colonne is None:
+        colonne = cached["colonne"] = _colonne_numpy(df)
+    return colonne, info
+
+
+def _last_close(df: pd.DataFrame) -> float:
+    """Ultimo prezzo di chiusura, letto direttamente dall'ndarray sottostante."""
+    return float(df['Close'].to_numpy()[-1])
+
+
+def estrai_ticker(data: Optional[pd.DataFrame], ticker: str) -> pd.DataFrame:
+    """Estrae i dati di un singolo ticker da un download multi-ticker."""
+    if data is None or data.empty:
+        return pd.DataFrame()
+    if isinstance(data.columns, pd.MultiIndex):
+        if ticker not in data.columns.get_level_values(0):
+            return pd.DataFrame()
+        data = data[ticker]
+    return data.dropna(subset=["Close"])
+
+
+def prefetch_data(tickers: List[str], periodo: str = "2y") -> None:
+    """Precarica in cache, con un'unica richiesta, i dati storici dei ticker mancanti."""
+    mancanti = [t for t in dict.fromkeys(tickers) if _cache_lookup(t, periodo) is None]
+    if len(mancanti) < 2:
+        return
+
+    import yfinance as yf
+
+    try:
+        # auto_adjust esplicito: in yfinance 0.2.x download non aggiusta i prezzi mentre
+        # Ticker.history sì, e la cache deve contenere lo stesso Close qualunque strada la riempia
+        # ignore_tz=True: ogni ticker tiene l'ora locale della propria borsa. Con False yfinance
+        # converte tutto il batch al fuso più frequente e le barre europee o asiatiche delle 00:00
+        # scivolerebbero al giorno precedente
+        data = yf.download(mancanti, period=periodo, group_by="ticker", threads=True, progress=False,
+                           ignore_tz=True, auto_adjust=True, actions=False)
+    except Exception:
+        return
+
+    # I ticker non trovati restano fuori cache: get_cached_data proverà i suffissi alternativi
+    for t in mancanti:
+        df = estrai_ticker(data, t)
+        if not df.empty:
+            _salva_in_cache(t, periodo, df, t)
+
+
+_ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NAIVE_UTC | orjson.OPT_NON_STR_KEYS
+
+
+def to_json(payload: Any, indent: bool = False) -> str:
+    """Serializza in JSON con orjson (tipi numpy e datetime gestiti nativamente)."""
+    option = (_ORJSON_OPTIONS | orjson.OPT_INDENT_2) if indent else _ORJSON_OPTIONS
+    return orjson.dumps(payload, option=option, default=str).decode()
+
+
+# Orologio memoizzato: (minuto epoch, mese) e (secondo epoch, timestamp ISO).
+# Le tuple sono riassegnate in blocco, quindi la lettura concorrente resta coerente.
+_mese_memo: Tuple[int, int] = (-1, 0)
+_iso_memo: Tuple[int, str] = (-1, "")
+
+
+def _current_month() -> int:
+    """Mese corrente, ricalcolato con datetime.now() al più una volta al minuto."""
+    global _mese_memo
+    minuto = int(time.time() // 60)
+    if _mese_memo[0] != minuto:
+        _mese_memo = (minuto, datetime.now().month)
+    return _mese_memo[1]
+
+
+def _now_iso() -> str:
+    """Timestamp ISO locale al secondo, ricalcolato al più una volta al secondo."""
+    global _iso_memo
+    secondo = int(time.time())
+    if _iso_memo[0] != secondo:
+        _iso_memo = (secondo, datetime.fromtimestamp(secondo).isoformat())
+    return _iso_memo[1]
 
 
 def parse_ticker_uri(uri: str) -> Tuple[str, str]:
@@ -84,12 +345,20 @@ def ottieni_quote_ora(tickers: list[str]) -> dict:
         dict con la struttura {ticker: {'price': float, 'timestamp': datetime}}
     """
     quotes = {}
+    if not tickers:
+        return quotes
+
+    import yfinance as yf
+
+    # Un'unica richiesta batch (download paralleli) invece di una per ticker
+    # Prezzi aggiustati come in Ticker.history, così la quota coincide con il Close in cache
+    data = yf.download(tickers, period="1d", group_by="ticker", threads=True, progress=False,
+                       auto_adjust=True, actions=False)
     for t in tickers:
-        # Scarica l'ultimo periodo (default 1d) e prende l’ultima riga
-        data = yf.Ticker(t).history(period="1d")
-        if not data.empty:
-            price   = float(data['Close'].iloc[-1])
-            ts      = data.index[-1].to_pydatetime().strftime("%Y-%m-%dT%H:%M:%S")
+        df = estrai_ticker(data, t)
+        if not df.empty:
+            price   = _last_close(df)
+            ts      = df.index[-1].to_pydatetime().strftime("%Y-%m-%dT%H:%M:%S")
             quotes[t] = {"price": price, "timestamp": ts}
     return quotes
 
@@ -97,41 +366,184 @@ def ottieni_quote_ora(tickers: list[str]) -> dict:
 # INDICATORI TECNICI
 # ============================================================================
 
-def calcola_rsi(df: pd.DataFrame, periodo: int = 14) -> float:
+@njit(cache=True, fastmath=True)
+def _rsi_wilder(close: np.ndarray, n: int) -> float:
+    """RSI (smoothing di Wilder) dell'ultima barra; NaN finché non ci sono n variazioni."""
+    if close.size <= n:
+        return np.nan
+    avg_gain = 0.0
+    avg_loss = 0.0
+    for i in range(1, close.size):
+        delta = close[i] - close[i - 1]
+        gain = delta if delta > 0 else 0.0
+        loss = -delta if delta < 0 else 0.0
+        if i == 1:
+            avg_gain, avg_loss = gain, loss
+        else:
+            avg_gain = (avg_gain * (n - 1) + gain) / n
+            avg_loss = (avg_loss * (n - 1) + loss) / n
+    totale = avg_gain + avg_loss
+    return 100.0 * avg_gain / totale if totale > 0 else np.nan
+
+
+@njit(cache=True, fastmath=True)
+def _macd_last(close: np.ndarray, fast: int, slow: int, signal: int) -> Tuple[float, float, float]:
+    """MACD, signal e istogramma dell'ultima barra: le tre EMA avanzano nello stesso ciclo."""
+    alpha_fast = 2.0 / (fast + 1.0)
+    alpha_slow = 2.0 / (slow + 1.0)
+    alpha_signal = 2.0 / (signal + 1.0)
+    ema_fast = close[0]
+    ema_slow = close[0]
+    ema_signal = 0.0
+    for i in range(1, close.size):
+        ema_fast = alpha_fast * close[i] + (1.0 - alpha_fast) * ema_fast
+        ema_slow = alpha_slow * close[i] + (1.0 - alpha_slow) * ema_slow
+        ema_signal = alpha_signal * (ema_fast - ema_slow) + (1.0 - alpha_signal) * ema_signal
+    macd = ema_fast - ema_slow
+    return macd, ema_signal, macd - ema_signal
+
+
+@njit(cache=True, fastmath=True)
+def _bb_last(close: np.ndarray, n: int, k: float) -> Tuple[float, float]:
+    """Bande di Bollinger (superiore, inferiore) calcolate solo sull'ultima finestra."""
+    # Welford su una sola passata, senza array temporanei; deviazione standard di popolazione (ddof=0)
+    conteggio = 0
+    media = 0.0
+    m2 = 0.0
+    for i in range(max(0, close.size - n), close.size):
+        conteggio += 1
+        delta = close[i] - media
+        media += delta / conteggio
+        m2 += delta * (close[i] - media)
+    std = np.sqrt(m2 / conteggio)
+    return media + k * std, media - k * std
+
+
+@njit(cache=True, fastmath=True)
+def _vol_last(close: np.ndarray, n: int) -> float:
+    """Volatilità annualizzata (%) degli ultimi n rendimenti semplici, in un solo passaggio."""
+    inizio = max(1, close.size - n)
+    conteggio = 0
+    media = 0.0
+    m2 = 0.0
+    # Welford: media e varianza senza allocare l'array dei rendimenti
+    for i in range(inizio, close.size):
+        r = close[i] / close[i - 1] - 1.0
+        conteggio += 1
+        delta = r - media
+        media += delta / conteggio
+        m2 += delta * (r - media)
+    if conteggio < 2:
+        return np.nan
+    return np.sqrt(m2 / (conteggio - 1)) * np.sqrt(252.0) * 100.0
+
+
+@njit(cache=True, fastmath=True)
+def _rsi_mom_vol(close: np.ndarray, n_rsi: int, n_mom: int, n_vol: int) -> Tuple[float, float, float]:
+    """RSI di Wilder, momentum (%) e volatilità annualizzata (%) in un solo passaggio sul close."""
+    avg_gain = 0.0
+    avg_loss = 0.0
+    inizio_vol = max(1, close.size - n_vol)
+    conteggio = 0
+    media = 0.0
+    m2 = 0.0
+    for i in range(1, close.size):
+        delta = close[i] - close[i - 1]
+        gain = delta if delta > 0 else 0.0
+        loss = -delta if delta < 0 else 0.0
+        if i == 1:
+            avg_gain, avg_loss = gain, loss
+        else:
+            avg_gain = (avg_gain * (n_rsi - 1) + gain) / n_rsi
+            avg_loss = (avg_loss * (n_rsi - 1) + loss) / n_rsi
+        if i >= inizio_vol:
+            r = close[i] / close[i - 1] - 1.0
+            conteggio += 1
+            d = r - media
+            media += d / conteggio
+            m2 += d * (r - media)
+
+    totale = avg_gain + avg_loss
+    rsi = 100.0 * avg_gain / totale if close.size > n_rsi and totale > 0 else np.nan
+    mom = (close[-1] - close[-n_mom]) / close[-n_mom] * 100.0 if close.size >= n_mom else 0.0
+    vol = np.sqrt(m2 / (conteggio - 1)) * np.sqrt(252.0) * 100.0 if conteggio >= 2 else np.nan
+    return rsi, mom, vol
+
+
+@njit(cache=True, fastmath=True)
+def _log_returns(close: np.ndarray) -> np.ndarray:
+    """Rendimenti logaritmici giornalieri, allocati una sola volta."""
+    out = np.empty(max(close.size - 1, 0))
+    for i in range(close.size - 1):
+        out[i] = np.log(close[i + 1] / close[i])
+    return out
+
+
+def _warmup_kernels() -> None:
+    """Compila i kernel all'avvio, così la prima chiamata a un tool non paga la JIT."""
+    prezzi = np.linspace(100.0, 130.0, 300)
+    _rsi_wilder(prezzi, 14)
+    _macd_last(prezzi, 12, 26, 9)
+    _bb_last(prezzi, 20, 2.0)
+    _vol_last(prezzi, 30)
+    _rsi_mom_vol(prezzi, 14, 30, 60)
+    _log_returns(prezzi)
+
+
+_warmup_kernels()
+
+
+def _close_array(dati: Union[pd.DataFrame, np.ndarray]) -> np.ndarray:
+    """Prezzi di chiusura come ndarray float64 contiguo per i kernel numba (gli ndarray passano invariati)."""
+    if isinstance(dati, np.ndarray):
+        return dati
+    return np.ascontiguousarray(dati['Close'].to_numpy(dtype=np.float64))
+
+
+def _media_finale(close: np.ndarray, n: int) -> float:
+    """Media mobile a n periodi dell'ultima barra (NaN se la serie è più corta)."""
+    return float(close[-n:].mean()) if close.size >= n else np.nan
+
+
+def calcola_rsi(dati: Union[pd.DataFrame, np.ndarray], periodo: int = 14) -> float:
     """Calcola RSI."""
-    rsi = ta.rsi(df['Close'], length=periodo)
-    return float(rsi.iloc[-1]) if not rsi.empty else 0.0
+    close = _close_array(dati)
+    return float(_rsi_wilder(close, int(periodo))) if close.size else 0.0
 
 
-def calcola_momentum(df: pd.DataFrame, periodo: int = 10) -> float:
+def calcola_momentum(dati: Union[pd.DataFrame, np.ndarray], periodo: int = 10) -> float:
     """Calcola momentum."""
-    if len(df) < periodo:
+    close = _close_array(dati)
+    periodo = int(periodo)
+    if close.size < periodo:
         return 0.0
-    return float((df['Close'].iloc[-1] - df['Close'].iloc[-periodo]) / df['Close'].iloc[-periodo] * 100)
+    return float((close[-1] - close[-periodo]) / close[-periodo] * 100)
 
 
-def calcola_macd(df: pd.DataFrame) -> Dict[str, float]:
+def calcola_macd(dati: Union[pd.DataFrame, np.ndarray]) -> Dict[str, float]:
     """Calcola MACD."""
-    macd = ta.macd(df['Close'])
-    if macd is None or macd.empty:
+    close = _close_array(dati)
+    if close.size < 26:
         return {"valore": 0.0, "signal": 0.0, "divergenza": 0.0}
 
+    macd, signal, divergenza = _macd_last(close, 12, 26, 9)
+
     return {
-        "valore": float(macd['MACD_12_26_9'].iloc[-1]),
-        "signal": float(macd['MACDs_12_26_9'].iloc[-1]),
-        "divergenza": float(macd['MACDh_12_26_9'].iloc[-1])
+        "valore": float(macd),
+        "signal": float(signal),
+        "divergenza": float(divergenza)
     }
 
 
-def calcola_bollinger_bands(df: pd.DataFrame, periodo: int = 20) -> Dict[str, float]:
+def calcola_bollinger_bands(dati: Union[pd.DataFrame, np.ndarray], periodo: int = 20) -> Dict[str, float]:
     """Calcola Bollinger Bands."""
-    bb = ta.bbands(df['Close'], length=periodo)
-    if bb is None or bb.empty:
+    periodo = int(periodo)
+    close = _close_array(dati)
+    if close.size < periodo:
         return {"posizione_percentuale": 0.0, "superiore": 0.0, "inferiore": 0.0}
 
-    prezzo = df['Close'].iloc[-1]
-    superiore = bb[f'BBU_{periodo}_2.0_2.0'].iloc[-1]
-    inferiore = bb[f'BBL_{periodo}_2.0_2.0'].iloc[-1]
+    prezzo = close[-1]
+    superiore, inferiore = _bb_last(close, periodo, 2.0)
 
     posizione = ((prezzo - inferiore) / (superiore - inferiore)) * 100 if superiore != inferiore else 50.0
 
@@ -142,60 +554,151 @@ def calcola_bollinger_bands(df: pd.DataFrame, periodo: int = 20) -> Dict[str, fl
     }
 
 
-def calcola_volatilita(df: pd.DataFrame, periodo: int = 30) -> float:
+def calcola_volatilita(dati: Union[pd.DataFrame, np.ndarray], periodo: int = 30) -> float:
     """Calcola volatilità annualizzata."""
-    rendimenti = df['Close'].pct_change()
-    vol = rendimenti.tail(periodo).std() * np.sqrt(252) * 100
-    return float(vol)
+    return float(_vol_last(_close_array(dati), int(periodo)))
 
 
-def analisi_stagionalita(df: pd.DataFrame) -> Dict[str, Any]:
-    """Analizza pattern stagionali."""
-    df_copia = df.copy()
-    df_copia['Mese'] = df_copia.index.month
-    df_copia['Rendimento'] = df_copia['Close'].pct_change() * 100
+def analisi_stagionalita(df: pd.DataFrame, mese_corrente: Optional[int] = None) -> Dict[str, Any]:
+    """Analizza pattern stagionali; mese_corrente di default è quello dell'orologio memoizzato."""
+    close = _close_array(df)
+    rendimenti = np.diff(close) / close[:-1] * 100
+    mesi = df.index.month.to_numpy()[1:]
 
-    stagionalita = df_copia.groupby('Mese')['Rendimento'].mean()
-    mese_corrente = datetime.now().month
+    # Media dei rendimenti per mese via bincount: nessuna copia del DataFrame né groupby
+    somme = np.bincount(mesi, weights=rendimenti, minlength=13)
+    conteggi = np.bincount(mesi, minlength=13)
+    mesi_presenti = np.flatnonzero(conteggi)
+    medie = somme[mesi_presenti] / conteggi[mesi_presenti]
+    dati_mensili = {int(m): float(v) for m, v in zip(mesi_presenti, medie)}
+    if mese_corrente is None:
+        mese_corrente = _current_month()
 
     return {
-        "mese_migliore": int(stagionalita.idxmax()),
-        "rendimento_migliore": float(stagionalita.max()),
-        "mese_peggiore": int(stagionalita.idxmin()),
-        "rendimento_peggiore": float(stagionalita.min()),
+        "mese_migliore": int(mesi_presenti[medie.argmax()]),
+        "rendimento_migliore": float(medie.max()),
+        "mese_peggiore": int(mesi_presenti[medie.argmin()]),
+        "rendimento_peggiore": float(medie.min()),
         "mese_corrente": mese_corrente,
-        "tendenza_mese_corrente": float(stagionalita.get(mese_corrente, 0)),
-        "dati_mensili": {int(k): float(v) for k, v in stagionalita.to_dict().items()}
+        "tendenza_mese_corrente": dati_mensili.get(mese_corrente, 0.0),
+        "dati_mensili": dati_mensili
     }
 
 
+# Indicizzata da (prezzo > MA50) << 2 | (MA50 > MA200) << 1 | (prezzo < MA50 < MA200);
+# le combinazioni impossibili ricadono sull'etichetta del ramo corrispondente.
+_TREND_TABLE = (
+    "Ribassista", "Ribassista Forte", "Ribassista", "Ribassista",
+    "Rialzista", "Rialzista", "Rialzista Forte", "Rialzista Forte",
+)
+
+
+def classifica_trend(prezzo: float, ma_50: float, ma_200: float) -> str:
+    """Classifica il trend dalla posizione del prezzo rispetto alle medie mobili."""
+    idx = (int(prezzo > ma_50) << 2) | (int(ma_50 > ma_200) << 1) | int(prezzo < ma_50 < ma_200)
+    return _TREND_TABLE[idx]
+
+
 def analisi_trend(df: pd.DataFrame) -> Dict[str, Any]:
     """Analizza trend con medie mobili."""
-    prezzo = df['Close'].iloc[-1]
-    ma_50 = df['Close'].rolling(50).mean().iloc[-1]
-    ma_200 = df['Close'].rolling(200).mean().iloc[-1]
-
-    if prezzo > ma_50 > ma_200:
-        trend = "Rialzista Forte"
-    elif prezzo > ma_50:
-        trend = "Rialzista"
-    elif prezzo < ma_50 < ma_200:
-        trend = "Ribassista Forte"
-    else:
-        trend = "Ribassista"
+    close = _close_array(df)
+    prezzo = close[-1]
+    ma_50 = _media_finale(close, 50)
+    ma_200 = _media_finale(close, 200)
 
     return {
-        "trend": trend,
+        "trend": classifica_trend(prezzo, ma_50, ma_200),
         "prezzo": float(prezzo),
         "ma_50": float(ma_50),
         "ma_200": float(ma_200)
     }
 
+
+def compute_all_indicators(df: pd.DataFrame) -> Dict[str, Any]:
+    """
+    Calcola tutti gli indicatori tecnici di analisi_completa in un'unica passata.
+
+    Il close array e le medie mobili sono estratti una sola volta e passati
+    ai kernel numba invece di essere riderivati in ogni singolo calcola_*.
+    """
+    close = _close_array(df)
+    prezzo = float(close[-1])
+
+    # RSI (Wilder, 14 periodi)
+    rsi = _rsi_wilder(close, 14)
+
+    # MACD (12, 26, 9), azzerato sotto le 26 barre come in calcola_macd
+    macd_val, signal_val, divergenza = _macd_last(close, 12, 26, 9) if close.size >= 26 else (0.0, 0.0, 0.0)
+
+    # Bollinger Bands (20, 2), azzerate sotto le 20 barre come in calcola_bollinger_bands
+    if close.size >= 20:
+        superiore, inferiore = _bb_last(close, 20, 2.0)
+        posizione = ((prezzo - inferiore) / (superiore - inferiore)) * 100 if superiore != inferiore else 50.0
+    else:
+        superiore, inferiore, posizione = 0.0, 0.0, 0.0
+
+    # Medie mobili per il trend
+    ma_50 = _media_finale(close, 50)
+    ma_200 = _media_finale(close, 200)
+
+    return {
+        "rsi": float(rsi),
+        "momentum_10gg": float((prezzo - close[-10]) / close[-10] * 100) if len(close) >= 10 else 0.0,
+        "macd": {
+            "valore": float(macd_val),
+            "signal": float(signal_val),
+            "divergenza": float(divergenza)
+        },
+        "bollinger_bands": {
+            "posizione_percentuale": float(posizione),
+            "superiore": float(superiore),
+            "inferiore": float(inferiore)
+        },
+        "volatilita": float(_vol_last(close, 30)),
+        "trend": {
+            "trend": classifica_trend(prezzo, ma_50, ma_200),
+            "prezzo": prezzo,
+            "ma_50": float(ma_50),
+            "ma_200": float(ma_200)
+        }
+    }
+
 # ============================================================================
 # GESTIONE PORTAFOGLIO
 # ============================================================================
 
-def valuta_portafoglio(holdings: Dict[str, float]) -> Dict[str, Any]:
+def _analizza_asset(
+    ticker: str, peso: float
+) -> Tuple[Dict[str, Any], Optional[Tuple[np.ndarray, np.ndarray]], Optional[float]]:
+    """Analizza un singolo asset del portafoglio: (analisi, (giorni, rendimenti giornalieri), volatilità)."""
+    try:
+        colonne, info = get_cached_arrays(ticker, "1y")
+        close = colonne.get("Close")
+        if close is None or close.size == 0:
+            return {"error": "Dati non disponibili"}, None, None
+
+        prezzo = float(close[-1])
+        # RSI, momentum e volatilità con un'unica scansione del close invece di tre
+        rsi, momentum, volatilita = (float(x) for x in _rsi_mom_vol(close, 14, 30, 60))
+        # Rendimenti logaritmici completi per la matrice di correlazione, con il giorno
+        # di ciascuno per allinearli per data tra asset con calendari diversi
+        giorni = colonne.get("Giorno")
+        rendimenti = (giorni[1:], _log_returns(close)) if giorni is not None else None
+
+        return {
+            "peso_percentuale": peso,
+            "prezzo_corrente": round(prezzo, 2),
+            "rsi": round(rsi, 2),
+            "momentum_30gg": round(momentum, 2),
+            "volatilita_annua": round(volatilita, 2),
+            "settore": info.get("sector", "N/A"),
+            "tipo": info.get("quoteType", "N/A")
+        }, rendimenti, volatilita
+    except Exception as e:
+        return {"error": str(e)}, None, None
+
+
+async def valuta_portafoglio(holdings: Dict[str, float]) -> Dict[str, Any]:
     """Valuta portafoglio esistente."""
     risultati = {
         "composizione": holdings,
@@ -205,55 +708,57 @@ def valuta_portafoglio(holdings: Dict[str, float]) -> Dict[str, Any]:
         "raccomandazioni": []
     }
 
-    total = sum(holdings.values())
+    # fsum: somma esatta per il controllo di tolleranza; l'array dei pesi serve ai calcoli successivi
+    total = math.fsum(holdings.values())
+    pesi_holdings = np.fromiter(holdings.values(), dtype=np.float64, count=len(holdings)) / 100
     if abs(total - 100.0) > 0.1:
         risultati["warning"] = f"Percentuali sommano a {total}%"
 
-    rendimenti_giornalieri = []
+    rendimenti_giornalieri = {}
     volatilita_assets = {}
 
-    for ticker, peso in holdings.items():
-        try:
-            df, info = get_cached_data(ticker, "1y")
-            if df.empty:
-                risultati["analisi_per_asset"][ticker] = {"error": "Dati non disponibili"}
-                continue
+    await _run_blocking(prefetch_data, list(holdings.keys()), "1y")
 
-            prezzo = float(df['Close'].iloc[-1])
-            rsi = calcola_rsi(df)
-            momentum = calcola_momentum(df, 30)
-            volatilita = calcola_volatilita(df, 60)
+    # Download e indicatori dei singoli asset sono indipendenti: li eseguiamo in parallelo
+    analisi_assets = await asyncio.gather(
+        *[_run_blocking(_analizza_asset, ticker, peso) for ticker, peso in holdings.items()]
+    )
 
-            rendimenti = df['Close'].pct_change().dropna()
-            rendimenti_giornalieri.append(rendimenti)
+    for ticker, (analisi, rendimenti, volatilita) in zip(holdings.keys(), analisi_assets):
+        risultati["analisi_per_asset"][ticker] = analisi
+        if rendimenti is not None:
+            rendimenti_giornalieri[ticker] = rendimenti
             volatilita_assets[ticker] = volatilita
 
-            risultati["analisi_per_asset"][ticker] = {
-                "peso_percentuale": peso,
-                "prezzo_corrente": round(prezzo, 2),
-                "rsi": round(rsi, 2),
-                "momentum_30gg": round(momentum, 2),
-                "volatilita_annua": round(volatilita, 2),
-                "settore": info.get("sector", "N/A"),
-                "tipo": info.get("quoteType", "N/A")
-            }
-        except Exception as e:
-            risultati["analisi_per_asset"][ticker] = {"error": str(e)}
-
     if len(rendimenti_giornalieri) >= 2:
         try:
-            df_rendimenti = pd.DataFrame({ticker: rend for ticker, rend in zip(holdings.keys(), rendimenti_giornalieri)})
-            correlazione = df_rendimenti.corr()
-
-            pesi_array = np.array(list(holdings.values())) / 100
-            vol_array = np.array([volatilita_assets.get(t, 0) for t in holdings.keys()])
-            volatilita_portafoglio = np.sqrt(np.dot(pesi_array**2, vol_array**2))
-
-            herfindahl = sum((p/100)**2 for p in holdings.values())
+            # Una riga per asset sui soli giorni comuni a tutti: i rendimenti sono appaiati
+            # per data, non per posizione (festività, buchi nei dati, borse diverse, crypto)
+            giorni_comuni = reduce(np.intersect1d, (giorni for giorni, _ in rendimenti_giornalieri.values()))
+            lunghezza = giorni_comuni.size
+            if lunghezza < 3:
+                raise ValueError("Giorni di contrattazione comuni insufficienti per la correlazione")
+            matrice_rendimenti = np.empty((len(rendimenti_giornalieri), lunghezza))
+            for i, (giorni, rendimenti) in enumerate(rendimenti_giornalieri.values()):
+                matrice_rendimenti[i] = rendimenti[np.searchsorted(giorni, giorni_comuni)]
+            # Pearson come singolo prodotto matriciale sui rendimenti standardizzati
+            matrice_rendimenti -= matrice_rendimenti.mean(axis=1, keepdims=True)
+            matrice_rendimenti /= matrice_rendimenti.std(axis=1, ddof=1, keepdims=True)
+            correlazione = (matrice_rendimenti @ matrice_rendimenti.T) / (lunghezza - 1)
+
+            # Varianza di portafoglio w' Σ w con Σ = D C D (D = volatilità, C = correlazioni)
+            tickers_validi = list(rendimenti_giornalieri.keys())
+            pesi_array = np.array([holdings[t] for t in tickers_validi]) / 100
+            vol_array = np.array([volatilita_assets[t] for t in tickers_validi])
+            covarianza = np.outer(vol_array, vol_array) * correlazione
+            volatilita_portafoglio = float(np.sqrt(pesi_array @ covarianza @ pesi_array))
+
+            # Indice di Herfindahl su tutti i pesi dichiarati, come prodotto scalare w·w
+            herfindahl = float(pesi_holdings @ pesi_holdings)
             n_effettivo = 1 / herfindahl if herfindahl > 0 else 0
 
-            mask = np.triu_indices_from(correlazione.values, k=1)
-            correlazione_media = correlazione.values[mask].mean()
+            mask = np.triu_indices_from(correlazione, k=1)
+            correlazione_media = correlazione[mask].mean()
 
             risultati["metriche_portafoglio"] = {
                 "volatilita_portafoglio": round(volatilita_portafoglio, 2),
@@ -274,38 +779,63 @@ def valuta_portafoglio(holdings: Dict[str, float]) -> Dict[str, Any]:
     return risultati
 
 
-def proponi_portafoglio(capitale: float, obiettivo: str = "bilanciato", orizzonte: str = "medio", rischio: str = "moderato") -> Dict[str, Any]:
-    """Propone un portafoglio ottimizzato."""
-    templates = {
-        "conservativo_bilanciato": {"BND": 40, "VTI": 25, "VXUS": 15, "VNQ": 10, "GLD": 10},
-        "moderato_bilanciato": {"VTI": 35, "VXUS": 25, "BND": 20, "VNQ": 10, "QQQ": 10},
-        "aggressivo_bilanciato": {"QQQ": 30, "VTI": 25, "VXUS": 20, "ARKK": 15, "BND": 10},
-        "conservativo_crescita": {"VTI": 35, "BND": 30, "VXUS": 20, "VNQ": 15},
-        "moderato_crescita": {"VTI": 40, "QQQ": 25, "VXUS": 20, "VNQ": 15},
-        "aggressivo_crescita": {"QQQ": 40, "ARKK": 25, "VTI": 20, "VXUS": 15},
-        "conservativo_reddito": {"BND": 45, "VYM": 30, "VNQ": 15, "VTI": 10},
-        "moderato_reddito": {"VYM": 35, "BND": 30, "VNQ": 20, "VTI": 15},
-        "aggressivo_reddito": {"VYM": 40, "VNQ": 25, "VTI": 20, "BND": 15}
-    }
+# Allocazioni modello di proponi_portafoglio, indicizzate per "{rischio}_{obiettivo}"
+TEMPLATES: Dict[str, Dict[str, int]] = {
+    "conservativo_bilanciato": {"BND": 40, "VTI": 25, "VXUS": 15, "VNQ": 10, "GLD": 10},
+    "moderato_bilanciato": {"VTI": 35, "VXUS": 25, "BND": 20, "VNQ": 10, "QQQ": 10},
+    "aggressivo_bilanciato": {"QQQ": 30, "VTI": 25, "VXUS": 20, "ARKK": 15, "BND": 10},
+    "conservativo_crescita": {"VTI": 35, "BND": 30, "VXUS": 20, "VNQ": 15},
+    "moderato_crescita": {"VTI": 40, "QQQ": 25, "VXUS": 20, "VNQ": 15},
+    "aggressivo_crescita": {"QQQ": 40, "ARKK": 25, "VTI": 20, "VXUS": 15},
+    "conservativo_reddito": {"BND": 45, "VYM": 30, "VNQ": 15, "VTI": 10},
+    "moderato_reddito": {"VYM": 35, "BND": 30, "VNQ": 20, "VTI": 15},
+    "aggressivo_reddito": {"VYM": 40, "VNQ": 25, "VTI": 20, "BND": 15}
+}
 
+
+# Universo dei ticker usati dai template, da tenere caldo in cache
+TEMPLATE_TICKERS = frozenset(t for allocazione in TEMPLATES.values() for t in allocazione)
+
+
+def warm_template_cache() -> None:
+    """Precarica in cache i dati a 1 anno dei ticker dei template (errori ignorati: è solo un'ottimizzazione)."""
+    tickers = sorted(TEMPLATE_TICKERS)
+    try:
+        prefetch_data(tickers, "1y")
+        list(_EXEC.map(get_cached_arrays, tickers, ["1y"] * len(tickers)))
+    except Exception:
+        pass
+
+
+def _analizza_proposta(ticker: str, importo: float) -> Optional[Dict[str, Any]]:
+    """Analizza un asset proposto; None se yfinance non restituisce dati."""
+    try:
+        colonne, info = get_cached_arrays(ticker, "1y")
+        close = colonne.get("Close")
+        if close is None or close.size == 0:
+            return None
+        return {
+            "prezzo": float(close[-1]),
+            "shares": int(importo / close[-1]),
+            "importo_effettivo": round(importo, 2),
+            "volatilita": round(calcola_volatilita(close), 2),
+            "momentum": round(calcola_momentum(close, 90), 2)
+        }
+    except Exception:
+        return {"error": "Dati non disponibili"}
+
+
+async def proponi_portafoglio(capitale: float, obiettivo: str = "bilanciato", orizzonte: str = "medio", rischio: str = "moderato") -> Dict[str, Any]:
+    """Propone un portafoglio ottimizzato."""
     template_key = f"{rischio}_{obiettivo}"
-    allocazione = templates.get(template_key, templates["moderato_bilanciato"])
+    allocazione = TEMPLATES.get(template_key, TEMPLATES["moderato_bilanciato"])
     importi = {ticker: (perc / 100) * capitale for ticker, perc in allocazione.items()}
 
-    analisi_assets = {}
-    for ticker in allocazione.keys():
-        try:
-            df, info = get_cached_data(ticker, "1y")
-            if not df.empty:
-                analisi_assets[ticker] = {
-                    "prezzo": float(df['Close'].iloc[-1]),
-                    "shares": int(importi[ticker] / df['Close'].iloc[-1]),
-                    "importo_effettivo": round(importi[ticker], 2),
-                    "volatilita": round(calcola_volatilita(df), 2),
-                    "momentum": round(calcola_momentum(df, 90), 2)
-                }
-        except:
-            analisi_assets[ticker] = {"error": "Dati non disponibili"}
+    # Le richieste dei singoli ticker partono insieme: con la cache fredda la latenza è un solo round-trip
+    proposte = await asyncio.gather(
+        *[_run_blocking(_analizza_proposta, ticker, importo) for ticker, importo in importi.items()]
+    )
+    analisi_assets = {ticker: analisi for ticker, analisi in zip(importi, proposte) if analisi is not None}
 
     return {
         "profilo": {"capitale": capitale, "obiettivo": obiettivo, "orizzonte_temporale": orizzonte, "tolleranza_rischio": rischio},
@@ -327,7 +857,7 @@ def crea_portafoglio(nome: str, holdings: Dict[str, Any], meta: Optional[Dict[st
         raise ValueError("Il portafoglio deve contenere almeno un asset")
 
     # Controllo che le percentuali sommino a 100%
-    totale_percentuale = sum(h.get('percentuale', 0) for h in holdings.values())
+    totale_percentuale = math.fsum(h.get('percentuale', 0) for h in holdings.values())
     if abs(totale_percentuale - 100.0) > 0.1:
         raise ValueError(f"Le percentuali degli asset devono sommare a 100%, attuale: {totale_percentuale:.2f}%")
 
@@ -336,7 +866,7 @@ def crea_portafoglio(nome: str, holdings: Dict[str, Any], meta: Optional[Dict[st
         "nome": nome,
         "tipo": "portfolio",
         "versione": "1.0",
-        "data_creazione": datetime.now().isoformat(),
+        "data_creazione": _now_iso(),
         "holdings": holdings,
         "meta": meta or {},
     }
@@ -351,8 +881,8 @@ def crea_portafoglio(nome: str, holdings: Dict[str, Any], meta: Optional[Dict[st
     return portfolio_structure
 
 
-def bilancia_portafoglio(holdings_correnti: Dict[str, float], target_allocation: Optional[Dict[str, float]] = None, metodo: str = "ribilanciamento") -> Dict[str, Any]:
-    """Bilancia portafoglio."""
+def bilancia_portafoglio(holdings_correnti: Dict[str, float], target_allocation: Optional[Dict[str, float]] = None, metodo: str = "ribilanciamento", max_operazioni: Optional[int] = None) -> Dict[str, Any]:
+    """Bilancia portafoglio; con max_operazioni restituisce solo le operazioni con drift maggiore."""
     risultati = {
         "portafoglio_corrente": holdings_correnti,
         "operazioni_suggerite": [],
@@ -366,35 +896,36 @@ def bilancia_portafoglio(holdings_correnti: Dict[str, float], target_allocation:
 
     risultati["target_allocation"] = target_allocation
 
-    differenze = {}
-    for ticker in set(list(holdings_correnti.keys()) + list(target_allocation.keys())):
-        corrente = holdings_correnti.get(ticker, 0)
-        target = target_allocation.get(ticker, 0)
-        diff = target - corrente
-
-        if abs(diff) > 1.0:
-            differenze[ticker] = diff
-
-    for ticker, diff in sorted(differenze.items(), key=lambda x: abs(x[1]), reverse=True):
-        if diff > 0:
-            risultati["operazioni_suggerite"].append({
-                "ticker": ticker,
-                "azione": "ACQUISTA",
-                "percentuale": round(diff, 2),
-                "priorita": "Alta" if abs(diff) > 10 else "Media" if abs(diff) > 5 else "Bassa"
-            })
-        else:
-            risultati["operazioni_suggerite"].append({
-                "ticker": ticker,
-                "azione": "VENDI",
-                "percentuale": round(abs(diff), 2),
-                "priorita": "Alta" if abs(diff) > 10 else "Media" if abs(diff) > 5 else "Bassa"
-            })
+    # Drift calcolato in blocco su array allineati all'unione ordinata dei ticker
+    tickers = np.array(sorted(set(holdings_correnti) | set(target_allocation)), dtype=object)
+    correnti = np.array([holdings_correnti.get(t, 0.0) for t in tickers], dtype=np.float64)
+    target = np.array([target_allocation.get(t, 0.0) for t in tickers], dtype=np.float64)
+    differenze = target - correnti
+    mask = np.abs(differenze) > 1.0
+    tickers, differenze = tickers[mask], differenze[mask]
+    drift = np.abs(differenze)
+    if max_operazioni is not None and 0 <= max_operazioni < drift.size:
+        # Selezione O(N) dei k drift maggiori: si ordinano solo quelli
+        k = int(max_operazioni)
+        selezionati = np.sort(np.argpartition(-drift, k - 1)[:k]) if k else np.empty(0, dtype=np.intp)
+        ordine = selezionati[np.argsort(-drift[selezionati], kind="stable")]
+    else:
+        ordine = np.argsort(-drift, kind="stable")
+
+    risultati["operazioni_suggerite"] = [
+        {
+            "ticker": ticker,
+            "azione": "ACQUISTA" if diff > 0 else "VENDI",
+            "percentuale": round(abs(diff), 2),
+            "priorita": "Alta" if abs(diff) > 10 else "Media" if abs(diff) > 5 else "Bassa"
+        }
+        for ticker, diff in zip(tickers[ordine].tolist(), differenze[ordine].tolist())
+    ]
 
     risultati["nuova_allocazione"] = target_allocation
 
     n_operazioni = len(risultati["operazioni_suggerite"])
-    drift_totale = sum(abs(d) for d in differenze.values())
+    drift_totale = float(drift.sum())
 
     risultati["analisi"] = {
         "numero_operazioni": n_operazioni,
@@ -425,21 +956,26 @@ async def read_resource(uri: str) -> str:
     """Leggi risorsa."""
     ticker, resource_type = parse_ticker_uri(uri)
     if not ticker:
-        return json.dumps({"error": "Ticker non valido"})
+        return to_json({"error": "Ticker non valido"})
 
     try:
-        df, info = get_cached_data(ticker)
+        df, info = await _fetch(ticker)
 
         if resource_type == "history":
-            return json.dumps({"ticker": ticker, "data": df.tail(100).reset_index().to_dict(orient="records")}, default=str)
+            # Output colonnare: array numpy serializzati direttamente da orjson, nessun dict per riga
+            payload = {"ticker": ticker, "ts": df.index[-100:].as_unit("s").asi8}
+            for col in ("Open", "High", "Low", "Close", "Volume"):
+                payload[col.lower()] = np.ascontiguousarray(df[col].to_numpy()[-100:])
+            return to_json(payload)
         elif resource_type == "info":
-            return json.dumps({"ticker": ticker, "nome": info.get("longName", "N/A"), "settore": info.get("sector", "N/A")})
+            dati_info = await _run_blocking(get_cached_info, info.ticker)
+            return to_json({"ticker": ticker, "nome": dati_info.get("longName", "N/A"), "settore": dati_info.get("sector", "N/A")})
         elif resource_type == "quote":
-            return json.dumps({"ticker": ticker, "prezzo": float(df['Close'].iloc[-1]), "volume": int(df['Volume'].iloc[-1])})
+            return to_json({"ticker": ticker, "prezzo": _last_close(df), "volume": int(df['Volume'].to_numpy()[-1])})
     except Exception as e:
-        return json.dumps({"error": str(e)})
+        return to_json({"error": str(e)})
 
-    return json.dumps({"error": "Resource type non supportato"})
+    return to_json({"error": "Resource type non supportato"})
 
 # ============================================================================
 # MCP TOOLS
@@ -479,25 +1015,67 @@ async def list_tools() -> list[Tool]:
             },
             "required": ["nome", "holdings"]
         }),
-        Tool(name="bilancia_portafoglio", description="Bilancia portafoglio", inputSchema={"type": "object", "properties": {"holdings_correnti": {"type": "object", "additionalProperties": {"type": "number"}}, "target_allocation": {"type": "object", "additionalProperties": {"type": "number"}}}, "required": ["holdings_correnti"]})
+        Tool(name="bilancia_portafoglio", description="Bilancia portafoglio", inputSchema={"type": "object", "properties": {"holdings_correnti": {"type": "object", "additionalProperties": {"type": "number"}}, "target_allocation": {"type": "object", "additionalProperties": {"type": "number"}}, "max_operazioni": {"type": "integer", "minimum": 0}}, "required": ["holdings_correnti"]})
     ]
 
 
+def _calcola_tool_ticker(name: str, ticker: str, df: pd.DataFrame, info: LazyInfo, arguments: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Calcola il risultato di un tool per singolo ticker; None se il tool non esiste."""
+    if name == "calcola_rsi":
+        result = {"ticker": ticker, "rsi": calcola_rsi(df, arguments.get("periodo", 14))}
+    elif name == "calcola_momentum":
+        result = {"ticker": ticker, "momentum": calcola_momentum(df, arguments.get("periodo", 10))}
+    elif name == "calcola_macd":
+        result = {"ticker": ticker, **calcola_macd(df)}
+    elif name == "calcola_bollinger_bands":
+        result = {"ticker": ticker, **calcola_bollinger_bands(df, arguments.get("periodo", 20))}
+    elif name == "calcola_volatilita":
+        result = {"ticker": ticker, "volatilita": calcola_volatilita(df, arguments.get("periodo", 30))}
+    elif name == "analisi_stagionalita":
+        result = {"ticker": ticker, **analisi_stagionalita(df)}
+    elif name == "analisi_trend":
+        result = {"ticker": ticker, **analisi_trend(df)}
+    elif name == "analisi_completa":
+        indicatori = compute_all_indicators(df)
+        result = {
+            "ticker": ticker,
+            "nome_azienda": info.get("longName", ticker),
+            "prezzo_corrente": indicatori["trend"]["prezzo"],
+            "indicatori_tecnici": indicatori,
+            "stagionalita": analisi_stagionalita(df),
+            "fondamentali": {
+                "pe_ratio": info.get("trailingPE"),
+                "market_cap_mld": info.get("marketCap", 0) / 1e9 if info.get("marketCap") else None,
+                "dividend_yield": info.get("dividendYield"),
+                "beta": info.get("beta")
+            }
+        }
+    else:
+        return None
+
+    return result
+
+
 @app.call_tool()
 async def call_tool(name: str, arguments: Any) -> list[TextContent]:
     """Esegue tool."""
     try:
         if name in ["valuta_portafoglio", "proponi_portafoglio", "bilancia_portafoglio", "ottieni_quote_ora", "crea_portafoglio"]:
             if name == "valuta_portafoglio":
-                result = valuta_portafoglio(arguments.get("holdings", {}))
+                result = await valuta_portafoglio(arguments.get("holdings", {}))
             elif name == "proponi_portafoglio":
-                result = proponi_portafoglio(arguments.get("capitale"), arguments.get("obiettivo", "bilanciato"), arguments.get("orizzonte", "medio"), arguments.get("rischio", "moderato"))
+                result = await proponi_portafoglio(arguments.get("capitale"), arguments.get("obiettivo", "bilanciato"), arguments.get("orizzonte", "medio"), arguments.get("rischio", "moderato"))
             elif name == "bilancia_portafoglio":
-                result = bilancia_portafoglio(arguments.get("holdings_correnti", {}), arguments.get("target_allocation"))
+                result = await _run_blocking(
+                    partial(bilancia_portafoglio, max_operazioni=arguments.get("max_operazioni")),
+                    arguments.get("holdings_correnti", {}),
+                    arguments.get("target_allocation")
+                )
             elif name == "ottieni_quote_ora":
-                result = ottieni_quote_ora(arguments.get("tickers", []))
+                result = await _run_blocking(ottieni_quote_ora, arguments.get("tickers", []))
             elif name == "crea_portafoglio":
-                result = crea_portafoglio(
+                result = await _run_blocking(
+                    crea_portafoglio,
                     arguments.get("nome", ""),
                     arguments.get("holdings", {}),
                     arguments.get("meta")
@@ -505,62 +1083,59 @@ async def call_tool(name: str, arguments: Any) -> list[TextContent]:
         else:
             ticker = arguments.get("ticker", "").upper()
             if not ticker:
-                return [TextContent(type="text", text=json.dumps({"error": "Ticker richiesto"}))]
+                return [TextContent(type="text", text=to_json({"error": "Ticker richiesto"}))]
 
-            df, info = get_cached_data(ticker)
+            df, info = await _fetch(ticker)
             if df.empty:
-                return [TextContent(type="text", text=json.dumps({"error": f"Dati non disponibili per {ticker}"}))]
-
-            if name == "calcola_rsi":
-                result = {"ticker": ticker, "rsi": calcola_rsi(df, arguments.get("periodo", 14))}
-            elif name == "calcola_momentum":
-                result = {"ticker": ticker, "momentum": calcola_momentum(df, arguments.get("periodo", 10))}
-            elif name == "calcola_macd":
-                result = {"ticker": ticker, **calcola_macd(df)}
-            elif name == "calcola_bollinger_bands":
-                result = {"ticker": ticker, **calcola_bollinger_bands(df, arguments.get("periodo", 20))}
-            elif name == "calcola_volatilita":
-                result = {"ticker": ticker, "volatilita": calcola_volatilita(df, arguments.get("periodo", 30))}
-            elif name == "analisi_stagionalita":
-                result = {"ticker": ticker, **analisi_stagionalita(df)}
-            elif name == "analisi_trend":
-                result = {"ticker": ticker, **analisi_trend(df)}
-            elif name == "analisi_completa":
-                result = {
-                    "ticker": ticker,
-                    "nome_azienda": info.get("longName", ticker),
-                    "prezzo_corrente": float(df['Close'].iloc[-1]),
-                    "indicatori_tecnici": {
-                        "rsi": calcola_rsi(df),
-                        "momentum_10gg": calcola_momentum(df, 10),
-                        "macd": calcola_macd(df),
-                        "bollinger_bands": calcola_bollinger_bands(df),
-                        "volatilita": calcola_volatilita(df),
-                        "trend": analisi_trend(df)
-                    },
-                    "stagionalita": analisi_stagionalita(df),
-                    "fondamentali": {
-                        "pe_ratio": info.get("trailingPE"),
-                        "market_cap_mld": info.get("marketCap", 0) / 1e9 if info.get("marketCap") else None,
-                        "dividend_yield": info.get("dividendYield"),
-                        "beta": info.get("beta")
-                    }
-                }
-            else:
-                return [TextContent(type="text", text=json.dumps({"error": f"Tool '{name}' non riconosciuto"}))]
+                return [TextContent(type="text", text=to_json({"error": f"Dati non disponibili per {ticker}"}))]
+
+            # Indicatori e info aziendali sono lavoro sincrono (numpy, yfinance): girano nel pool
+            result = await _run_blocking(_calcola_tool_ticker, name, ticker, df, info, arguments)
+            if result is None:
+                return [TextContent(type="text", text=to_json({"error": f"Tool '{name}' non riconosciuto"}))]
 
-        return [TextContent(type="text", text=json.dumps(result, indent=2))]
+        return [TextContent(type="text", text=to_json(result, indent=True))]
     except Exception as e:
-        return [TextContent(type="text", text=json.dumps({"error": str(e)}))]
+        return [TextContent(type="text", text=to_json({"error": str(e)}))]
 
 # ============================================================================
 # MAIN
 # ============================================================================
 
+def build_app(transport: str = "stdio") -> Any:
+    """Restituisce l'applicazione per il trasporto scelto: server MCP (stdio) o wrapper FastAPI (http)."""
+    if transport == "stdio":
+        return app
+    if transport == "http":
+        # Quando il modulo gira come script il wrapper deve riusarlo, non importarne una seconda copia
+        sys.modules.setdefault("financial_mcp_server", sys.modules[__name__])
+        from mcp_streamable_wrapper import app as http_app
+        return http_app
+    raise ValueError(f"Trasporto non supportato: {transport}")
+
+
 async def main():
     """Avvia server MCP."""
     async with stdio_server() as (read_stream, write_stream):
         await app.run(read_stream, write_stream, app.create_initialization_options())
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Financial Analysis MCP Server")
+    parser.add_argument("--transport", choices=["stdio", "http"], default="stdio")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    # Ogni worker è un processo con cache e connessioni SSE proprie
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.transport == "http":
+        import uvicorn
+        if args.workers > 1:
+            # Con più processi uvicorn importa l'app da sé in ogni worker
+            uvicorn.run("mcp_streamable_wrapper:app", host=args.host, port=args.port, workers=args.workers, **UVICORN_OPTIONS)
+        else:
+            uvicorn.run(build_app("http"), host=args.host, port=args.port, **UVICORN_OPTIONS)
+    else:
+        # Sul trasporto http il precaricamento parte dal lifespan del wrapper, in ogni worker
+        threading.Thread(target=warm_template_cache, name="warm-templates", daemon=True).start()
+        asyncio.run(main())
\ No newline at end of file
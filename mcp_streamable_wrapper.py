@@ -5,18 +5,80 @@ Implementa il protocollo Streamable HTTP come specificato nelle specifiche MCP
 """
 
 import asyncio
-import json
 from typing import Any, Dict, List, Optional
+
+import orjson
 from fastapi import FastAPI, Request, Response, HTTPException
 from fastapi.responses import StreamingResponse
+from starlette.middleware.gzip import GZipMiddleware
 import uvicorn
 from contextlib import asynccontextmanager
 from sse_starlette.sse import EventSourceResponse
+from pydantic import TypeAdapter
+from mcp.types import Resource, TextContent, Tool
+
+# Importa il server originale MCP. Gli handler sono importati come funzioni: i metodi
+# omonimi di mcp_app (list_tools, call_tool, ...) sono decoratori di registrazione
+from financial_mcp_server import UVICORN_OPTIONS, _EXEC, app as mcp_app, warm_template_cache
+from financial_mcp_server import call_tool, list_resources, list_tools, read_resource
+
+# Serializzatori pydantic v2: le liste di modelli MCP diventano JSON lato Rust,
+# senza passare da un dict Python per elemento
+_TOOLS_ADAPTER = TypeAdapter(List[Tool])
+_RESOURCES_ADAPTER = TypeAdapter(List[Resource])
+_CONTENT_ADAPTER = TypeAdapter(List[TextContent])
+
+# Risultati di tools/list e resources/list già serializzati: il registro è statico
+# per tutta la vita del processo, quindi si calcolano una volta sola
+_TOOLS_CACHE: Optional[bytes] = None
+_RESOURCES_CACHE: Optional[bytes] = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Cache delle liste già calde alla prima richiesta
+    await _handle_tools_list({})
+    await _handle_resources_list({})
+    # Dati dei template precaricati in background in ogni worker, senza ritardare l'avvio:
+    # il primo proponi_portafoglio trova la cache già calda
+    asyncio.get_running_loop().run_in_executor(_EXEC, warm_template_cache)
+    yield
+
+
+app = FastAPI(title="Financial Analysis MCP Server - Streamable HTTP Wrapper", version="1.0.0", lifespan=lifespan)
+
+
+class GZipTranneSSE:
+    """
+    GZip per le risposte JSON (tools/list supera facilmente i 10 KB), ma non per /stream:
+    la compressione accumula i chunk nel buffer e romperebbe lo streaming SSE.
+    Il filtro è sul path perché il content-type si conosce solo a risposta iniziata.
+    """
+
+    def __init__(self, app, minimum_size: int = 1024):
+        self.app = app
+        self.gzip = GZipMiddleware(app, minimum_size=minimum_size)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] != "/stream":
+            await self.gzip(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
 
-# Importa il server originale MCP
-from financial_mcp_server import app as mcp_app
 
-app = FastAPI(title="Financial Analysis MCP Server - Streamable HTTP Wrapper", version="1.0.0")
+app.add_middleware(GZipTranneSSE, minimum_size=1024)
+
+
+def _json_default(obj: Any) -> Any:
+    """Fallback per orjson: i modelli pydantic di mcp (TextContent, opzioni di init) diventano dict JSON."""
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump(mode="json", by_alias=True)
+    return str(obj)
+
+
+def _dumps(payload: Any) -> bytes:
+    """Serializza con orjson (bytes pronti per la risposta)."""
+    return orjson.dumps(payload, default=_json_default)
 
 
 @app.get("/")
@@ -26,86 +88,221 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "service": "financial-mcp-server"}
+    return {"status": "healthy", "service": "financial-mcp-server", "sse_connections": _connessioni_attive}
+
+
+def _envelope(result: bytes, request_id: Any) -> bytes:
+    """Busta JSON-RPC attorno a un risultato già serializzato, senza riserializzarlo."""
+    return b'{"result":' + result + b',"jsonrpc":"2.0","id":' + orjson.dumps(request_id) + b'}'
+
+
+async def _handle_tools_list(body: Dict[str, Any]) -> bytes:
+    """Lista degli strumenti (serializzata una volta, poi servita dalla cache)."""
+    global _TOOLS_CACHE
+    if _TOOLS_CACHE is None:
+        tools = await list_tools()
+        _TOOLS_CACHE = _TOOLS_ADAPTER.dump_json(tools, by_alias=True)
+    return _TOOLS_CACHE
+
+
+async def _handle_resources_list(body: Dict[str, Any]) -> bytes:
+    """Lista delle risorse (serializzata una volta, poi servita dalla cache)."""
+    global _RESOURCES_CACHE
+    if _RESOURCES_CACHE is None:
+        resources = await list_resources()
+        _RESOURCES_CACHE = _RESOURCES_ADAPTER.dump_json(resources, by_alias=True)
+    return _RESOURCES_CACHE
+
+
+async def _handle_tools_call(body: Dict[str, Any]) -> bytes:
+    """Chiamata di uno strumento."""
+    tool_call_params = body.get("params", {})
+    tool_name = tool_call_params.get("name")
+    arguments = tool_call_params.get("arguments", {})
+
+    if not tool_name:
+        raise HTTPException(status_code=400, detail="Tool name is required")
+
+    return _CONTENT_ADAPTER.dump_json(await call_tool(tool_name, arguments), by_alias=True)
+
+
+async def _handle_resources_read(body: Dict[str, Any]) -> bytes:
+    """Lettura di una risorsa."""
+    uri = body.get("params", {}).get("uri")
+
+    if not uri:
+        raise HTTPException(status_code=400, detail="Resource URI is required")
+
+    return _dumps(await read_resource(uri))
+
+
+# Router dei metodi MCP: una sola lookup per richiesta al posto della catena if/elif
+HANDLERS = {
+    "tools/list": _handle_tools_list,
+    "resources/list": _handle_resources_list,
+    "tools/call": _handle_tools_call,
+    "resources/read": _handle_resources_read,
+}
+
+
+def _errore(code: int, message: str, request_id: Any) -> bytes:
+    """Busta JSON-RPC di errore."""
+    return _dumps({"error": {"code": code, "message": message}, "jsonrpc": "2.0", "id": request_id})
+
+
+# Risposta fissa per buste JSON-RPC non valide (id null, come da specifica)
+_INVALID_REQUEST_BYTES = _errore(-32600, "Invalid Request", None)
 
+# Metodo non supportato: busta fissa a cui si aggiunge solo l'id. Il nome del metodo,
+# scelto dal client, non viene riportato nella risposta
+_METHOD_NOT_SUPPORTED_TEMPLATE = b'{"error":{"code":-32601,"message":"Method not supported"},"jsonrpc":"2.0","id":'
 
-@app.post("/")
-async def handle_mcp_request(request: Request):
+
+async def _dispatch_one(body: Any) -> bytes:
+    """Valida la busta JSON-RPC, esegue il metodo richiesto e restituisce la risposta serializzata."""
+    # Buste non valide respinte subito, senza toccare il server MCP
+    if not isinstance(body, dict) or body.get("jsonrpc") != "2.0" or not isinstance(body.get("method"), str):
+        return _INVALID_REQUEST_BYTES
+
+    request_id = body.get("id")
+    handler = HANDLERS.get(body["method"])
+    if handler is None:
+        # Metodo non supportato
+        return _METHOD_NOT_SUPPORTED_TEMPLATE + orjson.dumps(request_id) + b"}"
+
+    try:
+        return _envelope(await handler(body), request_id)
+    except HTTPException:
+        raise
+    except Exception:
+        # Errore strutturato: nessun dettaglio dell'eccezione verso il client
+        return _errore(-32603, "Internal error", request_id)
+
+
+async def _dispatch_batch_item(item: Any) -> bytes:
+    """Come _dispatch_one, ma i parametri mancanti diventano un errore -32602 del solo elemento."""
+    try:
+        return await _dispatch_one(item)
+    except HTTPException as e:
+        return _errore(-32602, e.detail, item.get("id"))
+
+
+async def _dispatch_batch(batch: List[Any]) -> Optional[bytes]:
+    """Esegue in parallelo una batch JSON-RPC; None se contiene solo notifiche."""
+    if not batch:
+        return _INVALID_REQUEST_BYTES
+
+    risposte = await asyncio.gather(*[_dispatch_batch_item(item) for item in batch])
+    # Le notifiche (richieste valide senza id) non hanno risposta
+    risposte = [
+        risposta for item, risposta in zip(batch, risposte)
+        if not (isinstance(item, dict) and "id" not in item and risposta is not _INVALID_REQUEST_BYTES)
+    ]
+    if not risposte:
+        return None
+    return b"[" + b",".join(risposte) + b"]"
+
+
+# Dimensione massima del corpo di una richiesta POST
+MAX_BODY_BYTES = 1024 * 1024
+
+
+async def _leggi_body(request: Request) -> bytearray:
+    """Legge il corpo a blocchi in un buffer unico, rifiutando subito (413) quelli troppo grandi."""
+    try:
+        content_length = int(request.headers.get("content-length", "0"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid Content-Length header")
+    if content_length > MAX_BODY_BYTES:
+        raise HTTPException(status_code=413, detail="Request body too large")
+
+    body = bytearray()
+    async for chunk in request.stream():
+        body.extend(chunk)
+        # Content-Length può mancare o essere falso: il limite vale sui byte davvero ricevuti
+        if len(body) > MAX_BODY_BYTES:
+            raise HTTPException(status_code=413, detail="Request body too large")
+    return body
+
+
+# response_model=None: FastAPI non introspeziona né valida la risposta, già serializzata
+@app.post("/", response_class=Response, response_model=None)
+async def handle_mcp_request(request: Request) -> Response:
     """
     Endpoint principale per le richieste MCP secondo il protocollo Streamable HTTP.
     Riceve richieste POST e le elabora usando il server MCP originale.
     """
+    # Legge il corpo della richiesta
     try:
-        # Legge il corpo della richiesta
-        body = await request.json()
-        
-        # Determina il tipo di richiesta MCP
-        method = body.get("method")
-        
-        if method == "tools/list":
-            # Richiesta per la lista degli strumenti
-            tools = await mcp_app.list_tools()
-            response_data = {
-                "result": [tool.dict() for tool in tools],
-                "jsonrpc": "2.0",
-                "id": body.get("id")
-            }
-        elif method == "resources/list":
-            # Richiesta per la lista delle risorse
-            resources = await mcp_app.list_resources()
-            response_data = {
-                "result": [resource.dict() for resource in resources],
-                "jsonrpc": "2.0",
-                "id": body.get("id")
-            }
-        elif method == "tools/call":
-            # Richiesta per chiamare uno strumento
-            tool_call_params = body.get("params", {})
-            tool_name = tool_call_params.get("name")
-            arguments = tool_call_params.get("arguments", {})
-            
-            if not tool_name:
-                raise HTTPException(status_code=400, detail="Tool name is required")
-            
-            # Chiama lo strumento
-            result = await mcp_app.call_tool(tool_name, arguments)
-            response_data = {
-                "result": result,
-                "jsonrpc": "2.0",
-                "id": body.get("id")
-            }
-        elif method == "resources/read":
-            # Richiesta per leggere una risorsa
-            resource_params = body.get("params", {})
-            uri = resource_params.get("uri")
-            
-            if not uri:
-                raise HTTPException(status_code=400, detail="Resource URI is required")
-            
-            # Legge la risorsa
-            result = await mcp_app.read_resource(uri)
-            response_data = {
-                "result": result,
-                "jsonrpc": "2.0",
-                "id": body.get("id")
-            }
-        else:
-            # Metodo non supportato
-            response_data = {
-                "error": {
-                    "code": -32601,
-                    "message": f"Method {method} not supported"
-                },
-                "jsonrpc": "2.0",
-                "id": body.get("id")
-            }
-        
-        return response_data
-        
-    except json.JSONDecodeError:
+        body = orjson.loads(await _leggi_body(request))
+    except orjson.JSONDecodeError:
         raise HTTPException(status_code=400, detail="Invalid JSON in request body")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error processing MCP request: {str(e)}")
+
+    if isinstance(body, list):
+        content = await _dispatch_batch(body)
+        if content is None:
+            return Response(status_code=204)
+    else:
+        content = await _dispatch_one(body)
+
+    # Risposta già serializzata: FastAPI non ripassa il dict dal suo encoder JSON
+    return Response(content=content, media_type="application/json")
+
+
+# Evento di init identico per ogni connessione SSE: serializzato una volta al caricamento
+_INIT_EVENT = {
+    "event": "init",
+    "data": _dumps({
+        "capabilities": mcp_app.create_initialization_options(),
+        "server_info": {
+            "name": "financial-analysis-server",
+            "version": "1.0.0"
+        }
+    }).decode()
+}
+
+# Intervallo (secondi) dei ping keep-alive inviati da sse-starlette come commenti SSE
+SSE_PING_INTERVAL = 30
+# Eventi in attesa per connessione: oltre questo limite i produttori aspettano (backpressure)
+SSE_QUEUE_MAXSIZE = 64
+# Secondi di coda piena, o di singolo invio bloccato sul socket, dopo i quali
+# un client troppo lento viene disconnesso
+SSE_STALL_TIMEOUT = 60
+
+_CLOSE_EVENT = {"event": "close", "data": orjson.dumps({"message": "Connection closed"}).decode()}
+
+# Code in uscita delle connessioni SSE attive
+_sse_queues: set = set()
+# Contatore delle connessioni aperte, esposto da /health
+_connessioni_attive = 0
+
+
+def _chiudi_coda(queue: asyncio.Queue) -> None:
+    """
+    Scarta gli eventi in attesa di un client bloccato e gli accoda la chiusura.
+    Se il generatore è fermo nell'invio, la connessione la chiude il send_timeout di EventSourceResponse.
+    """
+    _sse_queues.discard(queue)
+    while not queue.empty():
+        queue.get_nowait()
+    queue.put_nowait(_CLOSE_EVENT)
+
+
+async def _invia_evento(queue: asyncio.Queue, event: Dict[str, str]) -> None:
+    """Accoda un evento a un client, chiudendo la connessione se resta bloccata."""
+    try:
+        await asyncio.wait_for(queue.put(event), SSE_STALL_TIMEOUT)
+    except asyncio.TimeoutError:
+        _chiudi_coda(queue)
+
+
+async def publish_event(event: Dict[str, str]) -> None:
+    """
+    Pubblica un evento MCP su tutte le connessioni SSE.
+    Con una coda piena il produttore attende; se resta piena per SSE_STALL_TIMEOUT
+    secondi il client viene disconnesso invece di far crescere la memoria.
+    """
+    await asyncio.gather(*[_invia_evento(queue, event) for queue in list(_sse_queues)])
 
 
 @app.get("/stream")
@@ -115,45 +312,29 @@ async def mcp_stream(request: Request):
     Permette connessioni persistenti per lo scambio di messaggi MCP.
     """
     async def event_generator():
+        global _connessioni_attive
+        # Coda limitata tra i produttori (publish_event) e il client
+        queue: asyncio.Queue = asyncio.Queue(maxsize=SSE_QUEUE_MAXSIZE)
+        # Invia messaggio di inizializzazione
+        queue.put_nowait(_INIT_EVENT)
+        _sse_queues.add(queue)
+        _connessioni_attive += 1
         try:
-            # Invia messaggio di inizializzazione
-            yield {
-                "event": "init",
-                "data": json.dumps({
-                    "capabilities": mcp_app.create_initialization_options(),
-                    "server_info": {
-                        "name": "financial-analysis-server",
-                        "version": "1.0.0"
-                    }
-                })
-            }
-            
-            # Simula la gestione di richieste in streaming
-            # In una implementazione completa, qui gestiremmo lo streaming bidirezionale
+            # Il keep-alive è il ping di EventSourceResponse: qui si inoltrano solo gli eventi MCP
             while True:
-                # Aspetta eventuali eventi dal server MCP
-                # Per ora, invia heartbeat periodici
-                yield {
-                    "event": "heartbeat",
-                    "data": json.dumps({
-                        "timestamp": asyncio.get_event_loop().time(),
-                        "status": "alive"
-                    })
-                }
-                
-                # Attendi prima del prossimo messaggio
-                await asyncio.sleep(30)
-                
-        except asyncio.CancelledError:
-            # La connessione è stata chiusa dal client
-            yield {
-                "event": "close",
-                "data": json.dumps({"message": "Connection closed"})
-            }
-            return
-
-    return EventSourceResponse(event_generator())
+                event = await queue.get()
+                yield event
+                if event is _CLOSE_EVENT:
+                    return
+        finally:
+            # Alla disconnessione del client il socket è già chiuso: si liberano solo le risorse
+            _sse_queues.discard(queue)
+            _connessioni_attive -= 1
+
+    # send_timeout chiude davvero il socket di un client fermo: l'evento di chiusura in coda
+    # non verrebbe mai letto da un generatore bloccato nell'invio
+    return EventSourceResponse(event_generator(), ping=SSE_PING_INTERVAL, send_timeout=SSE_STALL_TIMEOUT)
 
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=8000, **UVICORN_OPTIONS)
\ No newline at end of file
@@ -6,6 +6,19 @@ Uso: python test_mcp_server.py
 
 import asyncio
 import json
+import os
+
+try:
+    import uvloop
+    LOOP_FACTORY = uvloop.new_event_loop
+except ImportError:
+    # Su Windows (o senza uvloop) si usa il loop standard di asyncio
+    LOOP_FACTORY = None
+
+# Cache su disco condivisa tra le esecuzioni dei test: i rilanci entro CACHE_DURATION
+# rileggono i parquet invece di riscaricare lo storico da yfinance
+os.environ.setdefault("FINANCIAL_MCP_CACHE_DIR", os.path.expanduser("~/.cache/financial-mcp-tests"))
+
 from financial_mcp_server import (
     get_cached_data,
     calcola_rsi,
@@ -28,38 +41,44 @@ async def test_basic_functions():
     print("1️⃣  Test scaricamento dati...")
     df, info = get_cached_data(ticker)
     print(f"   ✅ Scaricati {len(df)} giorni di dati")
-    print(f"   ✅ Azienda: {info.get('longName', 'N/A')}")
-    
+
+    # I calcoli sono indipendenti tra loro: partono insieme, così le richieste
+    # di rete (info aziendali, quote realtime) si sovrappongono agli indicatori
+    tickers_to_test = ["AAPL", "MSFT"]
+    nome, rsi, momentum, macd, stag, trend, realtime_quotes = await asyncio.gather(
+        asyncio.to_thread(info.get, 'longName', 'N/A'),
+        asyncio.to_thread(calcola_rsi, df),
+        asyncio.to_thread(calcola_momentum, df, 10),
+        asyncio.to_thread(calcola_macd, df),
+        asyncio.to_thread(analisi_stagionalita, df),
+        asyncio.to_thread(analisi_trend, df),
+        asyncio.to_thread(ottieni_quote_ora, tickers_to_test),
+    )
+    print(f"   ✅ Azienda: {nome}")
+
     # Test RSI
     print("\n2️⃣  Test RSI...")
-    rsi = calcola_rsi(df)
     print(f"   ✅ RSI: {rsi:.2f}")
     
     # Test Momentum
     print("\n3️⃣  Test Momentum...")
-    momentum = calcola_momentum(df, 10)
     print(f"   ✅ Momentum (10gg): {momentum:.2f}%")
     
     # Test MACD
     print("\n4️⃣  Test MACD...")
-    macd = calcola_macd(df)
     print(f"   ✅ MACD: {json.dumps(macd, indent=4)}")
     
     # Test Stagionalità
     print("\n5️⃣  Test Stagionalità...")
-    stag = analisi_stagionalita(df)
     print(f"   ✅ Mese migliore: {stag['mese_migliore']} ({stag['rendimento_migliore']:.2f}%)")
     
     # Test Trend
     print("\n6️⃣  Test Trend...")
-    trend = analisi_trend(df)
     print(f"   ✅ Trend: {trend['trend']}")
     print(f"   ✅ Prezzo: ${trend['prezzo']:.2f}")
 
     # Test Realtime Quotes
     print("\n7️⃣  Test Realtime Quotes...")
-    tickers_to_test = ["AAPL", "MSFT"]
-    realtime_quotes = ottieni_quote_ora(tickers_to_test)
     for t, data in realtime_quotes.items():
         print(f"   ✅ {t}: Prezzo {data['price']:.2f} @ {data['timestamp']}")
     
@@ -68,4 +87,5 @@ async def test_basic_functions():
     print("=" * 80)
 
 if __name__ == "__main__":
-    asyncio.run(test_basic_functions())
\ No newline at end of file
+    with asyncio.Runner(loop_factory=LOOP_FACTORY) as runner:
+        runner.run(test_basic_functions())
\ No newline at end of file
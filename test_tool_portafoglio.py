@@ -7,10 +7,22 @@ import asyncio
 import json
 import sys
 import os
+import traceback
+
+try:
+    import uvloop
+    LOOP_FACTORY = uvloop.new_event_loop
+except ImportError:
+    # Su Windows (o senza uvloop) si usa il loop standard di asyncio
+    LOOP_FACTORY = None
 
 # Aggiungi il percorso del server
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
+# Cache su disco condivisa tra le esecuzioni dei test: i rilanci entro CACHE_DURATION
+# rileggono i parquet invece di riscaricare lo storico da yfinance
+os.environ.setdefault("FINANCIAL_MCP_CACHE_DIR", os.path.expanduser("~/.cache/financial-mcp-tests"))
+
 from financial_mcp_server import (
     valuta_portafoglio,
     proponi_portafoglio,
@@ -41,7 +53,7 @@ async def test_valuta_portafoglio():
     
     print("\n⏳ Analisi in corso...\n")
     
-    risultato = valuta_portafoglio(portafoglio)
+    risultato = await valuta_portafoglio(portafoglio)
     
     print("✅ RISULTATI:\n")
     print(f"📈 Asset nel portafoglio: {risultato['asset_count']}")
@@ -84,7 +96,7 @@ async def test_proponi_portafoglio():
 
     print("\n⏳ Proposta portafoglio...\n")
 
-    risultato = proponi_portafoglio(capitale, obiettivo, orizzonte, rischio)
+    risultato = await proponi_portafoglio(capitale, obiettivo, orizzonte, rischio)
 
     print("✅ PORTAFOGLIO SUGGERITO:\n")
 
@@ -197,23 +209,34 @@ async def test_tutti():
     print("    TEST COMPLETO TOOLS GESTIONE PORTAFOGLIO")
     print("🚀" * 40)
 
-    try:
-        await test_valuta_portafoglio()
-        await test_proponi_portafoglio()
-        await test_bilancia_portafoglio()
-        await test_crea_struttura_portafoglio()
+    # I test non condividono stato: girano insieme e i download yfinance si sovrappongono.
+    # L'output delle sezioni può risultare intercalato. Con return_exceptions un test
+    # che fallisce non interrompe gli altri, che arrivano comunque in fondo.
+    scenari = {
+        "TEST 1 - valuta_portafoglio": test_valuta_portafoglio,
+        "TEST 2 - proponi_portafoglio": test_proponi_portafoglio,
+        "TEST 3 - bilancia_portafoglio": test_bilancia_portafoglio,
+        "TEST 4 - crea_portafoglio": test_crea_struttura_portafoglio,
+    }
+    esiti = await asyncio.gather(*[test() for test in scenari.values()], return_exceptions=True)
 
-        print("\n" + "=" * 80)
-        print("✅ TUTTI I TEST COMPLETATI CON SUCCESSO!")
-        print("=" * 80 + "\n")
+    falliti = 0
+    for nome, esito in zip(scenari, esiti):
+        if isinstance(esito, BaseException):
+            falliti += 1
+            print(f"\n❌ ERRORE in {nome}: {esito!r}")
+            traceback.print_exception(esito)
 
-    except Exception as e:
-        print(f"\n❌ ERRORE: {e}")
-        import traceback
-        traceback.print_exc()
+    print("\n" + "=" * 80)
+    if falliti:
+        print(f"❌ {falliti} TEST SU {len(scenari)} FALLITI")
+    else:
+        print("✅ TUTTI I TEST COMPLETATI CON SUCCESSO!")
+    print("=" * 80 + "\n")
 
 if __name__ == "__main__":
     print("\n💡 Questo script testa i nuovi tools per la gestione del portafoglio")
     print("   Assicurati che il server sia configurato correttamente\n")
     
-    asyncio.run(test_tutti())
\ No newline at end of file
+    with asyncio.Runner(loop_factory=LOOP_FACTORY) as runner:
+        runner.run(test_tutti())
\ No newline at end of file